@@ -17,6 +17,7 @@ from bs4 import BeautifulSoup
 from striprtf.striprtf import rtf_to_text
 import zipfile
 import io
+from collections import namedtuple
 from bs4 import Comment
 from email.header import decode_header
 
@@ -25,6 +26,18 @@ from email.header import decode_header
 # Константа для временной зоны GMT+3
 GMT3 = timezone(timedelta(hours=3))
 
+# Запись о найденном письме, которую выдает iter_messages
+MessageMatch = namedtuple('MessageMatch', [
+    'msg_num',        # порядковый номер сообщения при обходе PST
+    'sender',
+    'receivers',      # список получателей
+    'subject',
+    'body',
+    'sent_time',      # datetime в GMT+3 или None
+    'received_time',  # datetime в GMT+3 или None
+    'message',        # объект pypff; действителен, только пока открыт PST (см. MessageSearch)
+])
+
 
 def print_header():
     """Выводит заголовок программы"""
@@ -33,8 +46,8 @@ def print_header():
     print("=" * 80 + "\n")
 
 
-def decode_mime_string(mime_string):
-    """Декодирует MIME-строку с учетом возможных ошибок"""
+def decode_mime_string(mime_string, on_error=None):
+    """Декодирует MIME-строку с учетом возможных ошибок (о них сообщает on_error, иначе print)"""
     if not mime_string or mime_string == "No value":
         return mime_string
 
@@ -55,11 +68,14 @@ def decode_mime_string(mime_string):
                 decoded_parts.append(str(part))
         return ' '.join(decoded_parts)
     except Exception as e:
-        print(f"Error decoding '{mime_string}': {e}")
+        if on_error:
+            on_error(f"Error decoding '{mime_string}': {e}")
+        else:
+            print(f"Error decoding '{mime_string}': {e}")
         return mime_string
 
 
-def get_header_value(headers, header_name):
+def get_header_value(headers, header_name, on_error=None):
     """
     Функция для извлечения значения заголовка по имени.
     Возвращает список строк (даже для одиночных значений).
@@ -67,6 +83,7 @@ def get_header_value(headers, header_name):
     Args:
         headers: Список строк заголовков
         header_name: Имя заголовка для поиска (без двоеточия)
+        on_error: Необязательная функция для ошибок декодирования (по умолчанию print)
 
     Returns:
         Список найденных значений заголовка (может быть пустым)
@@ -107,7 +124,7 @@ def get_header_value(headers, header_name):
         cleaned_value = ' '.join(value.replace('\r', '').replace('\n', '').split())
 
         # Декодируем MIME-кодированные части
-        decoded_value = decode_mime_string(cleaned_value)
+        decoded_value = decode_mime_string(cleaned_value, on_error)
 
         # Разделяем по запятым, но не внутри кавычек
         parts = re.split(r',\s*(?=(?:[^"]*"[^"]*")*[^"]*$)', decoded_value)
@@ -193,7 +210,7 @@ def format_datetime_gmt3(dt):
     return dt_gmt3.strftime('%Y-%m-%d %H:%M:%S (GMT+3)')
 
 
-def get_message_body(message):
+def get_message_body(message, on_error=None):
     """Улучшенное извлечение тела письма с обработкой RTF и нормализацией переносов строк"""
 
     def normalize_newlines(text):
@@ -235,7 +252,10 @@ def get_message_body(message):
 
         return "Тело письма отсутствует"
     except Exception as e:
-        print(f"[!] Ошибка извлечения тела письма: {e}")
+        if on_error:
+            on_error(f"Ошибка извлечения тела письма: {e}")
+        else:
+            print(f"[!] Ошибка извлечения тела письма: {e}")
         return "Не удалось извлечь текст"
 
 
@@ -526,88 +546,210 @@ def parse_time_range(time_str):
         print(f"[!] Ошибка при обработке диапазона времени {time_str}: {e}")
 
 
-def search_pst(pst_path, search_criteria, output_dir=None):
-    """Основная функция поиска в PST-файле"""
-    try:
-        print(f"[+] Открываю PST-файл: {pst_path}")
+def iter_folders(root, on_error=None):
+    """Итеративно (без рекурсии) обходит папки PST в том же порядке, что и рекурсивный обход"""
+    stack = [root]
+    while stack:
+        folder = stack.pop()
+        yield folder
+        # Читаем подпапки по индексу, чтобы поврежденная подпапка не отбрасывала остальные
+        subfolders = []
+        try:
+            number_of_sub_folders = folder.number_of_sub_folders
+        except Exception as e:
+            if on_error:
+                on_error(f"Ошибка доступа к папке: {e}")
+            continue
+        for i in range(number_of_sub_folders):
+            try:
+                subfolders.append(folder.get_sub_folder(i))
+            except Exception as e:
+                if on_error:
+                    on_error(f"Ошибка доступа к подпапке #{i + 1}: {e}")
+        # Кладем в обратном порядке, чтобы первая подпапка обрабатывалась первой
+        stack.extend(reversed(subfolders))
+
+
+def read_message(message, msg_num, on_error=None):
+    """Извлекает из сообщения поля, используемые для поиска"""
+    # Получаем заголовки сообщения
+    headers = message.get_transport_headers()
+    headers_lines = headers.splitlines() if headers else []
+
+    # Извлекаем данные из заголовков
+    sender_values = get_header_value(headers_lines, 'From', on_error)
+    receivers_values = get_header_value(headers_lines, 'To', on_error)
+    subject_values = get_header_value(headers_lines, 'Subject', on_error)
+
+    sender = sender_values[0] if sender_values else "Неизвестный отправитель"
+    receivers = receivers_values if receivers_values else ["Не указаны"]
+    subject = subject_values[0] if subject_values else "Без темы"
+
+    body = get_message_body(message, on_error)
+    # Конвертируем время в GMT+3
+    received_time = convert_to_gmt3(getattr(message, 'delivery_time', None))
+    sent_time = convert_to_gmt3(getattr(message, 'client_submit_time', None))
+
+    return MessageMatch(msg_num, sender, receivers, subject, body,
+                        sent_time, received_time, message)
+
+
+class MessageSearch:
+    """
+    Ленивый поиск писем в PST-файле: итератор по MessageMatch.
+
+    PST-файл открывается сразу при создании объекта (ошибка открытия
+    возникает здесь же) и закрывается, когда итерация завершена, вызван
+    close() или объект удален сборщиком мусора. Поле MessageMatch.message ссылается на объект
+    открытого файла, поэтому им можно пользоваться только до этого
+    момента: например, list(iter_messages(...)) дает записи, у которых
+    message уже недействителен.
+
+    На экран ничего не выводится: ошибки по отдельным папкам и письмам
+    передаются в on_error (если задан), а обход продолжается.
+
+    Атрибуты:
+        total: Число обработанных сообщений (окончательное после завершения итерации)
+        number_of_root_folders: Число папок в корне PST
+    """
+
+    def __init__(self, pst_path, search_criteria=None, on_error=None):
+        self.search_criteria = search_criteria or {}
+        self.on_error = on_error
+        self.total = 0
         pst = pypff.file()
         pst.open(pst_path)
+        self._pst = pst
+        try:
+            self._root = self._pst.get_root_folder()
+            self.number_of_root_folders = self._root.number_of_sub_folders
+        except Exception:
+            self._close_file()
+            raise
+        self._matches = self._iter_matches()
 
-        if output_dir:
-            ensure_output_dir(output_dir)
-            print(f"[+] Найденные письма будут сохранены в: {os.path.abspath(output_dir)}")
+    def __iter__(self):
+        return self
 
-        root = pst.get_root_folder()
-        print(f"[+] Найдено корневых папок: {root.number_of_sub_folders}")
+    def __next__(self):
+        return next(self._matches)
 
-        total_messages = process_folder(root, search_criteria, 0, output_dir)
+    def __enter__(self):
+        return self
 
-        print(f"\n[+] Поиск завершен. Обработано сообщений: {total_messages}")
-        if output_dir and os.path.exists(output_dir):
-            txt_files = [f for f in os.listdir(output_dir) if f.endswith('.txt')]
-            print(f"[+] Сохранено писем: {len(txt_files)}")
-        pst.close()
-    except IOError as e:
-        print(f"[!] Ошибка при открытии файла: {e}")
-    except Exception as e:
-        print(f"[!] Критическая ошибка: {e}")
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
 
+    def __del__(self):
+        # Брошенный без итерации и close() поиск не должен держать файл открытым
+        self.close()
+
+    def close(self):
+        """Прекращает поиск и закрывает PST-файл"""
+        matches = getattr(self, '_matches', None)
+        if matches is not None:
+            matches.close()
+        self._close_file()
+
+    def _close_file(self):
+        if getattr(self, '_pst', None) is not None:
+            self._pst.close()
+            self._pst = None
+
+    def _report(self, error):
+        if self.on_error:
+            self.on_error(error)
+
+    def _iter_matches(self):
+        # Ошибки вспомогательных функций не должны выводиться на экран
+        on_error = self.on_error or (lambda error: None)
+        try:
+            for folder in iter_folders(self._root, on_error):
+                try:
+                    number_of_sub_messages = folder.number_of_sub_messages
+                except Exception as e:
+                    self._report(f"Ошибка при обработке папки: {e}")
+                    continue
+
+                # Читаем письма по индексу, чтобы пропускать только поврежденные
+                for i in range(number_of_sub_messages):
+                    self.total += 1
+                    try:
+                        record = read_message(folder.get_sub_message(i), self.total, on_error)
+                        matched = matches_criteria(record.sender, record.subject, record.body,
+                                                   record.received_time, record.sent_time,
+                                                   self.search_criteria)
+                    except Exception as e:
+                        self._report(f"Ошибка при обработке сообщения #{self.total}: {e}")
+                        continue
+
+                    if matched:
+                        yield record
+        finally:
+            self._close_file()
+
+
+def iter_messages(pst_path, search_criteria=None, on_error=None):
+    """
+    Лениво выдает письма из PST-файла, подходящие под критерии поиска.
+
+    Рекомендуется использовать в блоке with, чтобы файл гарантированно закрывался:
+
+        with iter_messages(pst_path, criteria) as search:
+            for match in search:
+                ...
+
+    Args:
+        pst_path: Путь к PST-файлу
+        search_criteria: Словарь критериев (см. matches_criteria)
+        on_error: Необязательная функция, принимающая текст ошибки
+
+    Returns:
+        MessageSearch — итератор по MessageMatch с атрибутом total
+    """
+    return MessageSearch(pst_path, search_criteria, on_error)
 
-def process_folder(folder, search_criteria, counter, output_dir=None):
-    """Рекурсивно обрабатывает папки PST"""
-    try:
-        for message in folder.sub_messages:
-            counter += 1
-            process_message(message, search_criteria, counter, output_dir)
-
-        for subfolder in folder.sub_folders:
-            counter = process_folder(subfolder, search_criteria, counter, output_dir)
-    except AttributeError as e:
-        print(f"[!] Ошибка доступа к папке: {e}")
-    except Exception as e:
-        print(f"[!] Ошибка при обработке папки: {e}")
-    return counter
 
+def print_match(match):
+    """Выводит краткую информацию о найденном письме"""
+    print(f"\n[+] Найдено письмо #{match.msg_num}:")
+    print(f"    Отправитель: {match.sender}")
+    print(f"    Получатели: {match.receivers[0]}")
+    if len(match.receivers) > 1:
+        for receiver in match.receivers[1:]:
+            print(' ' * 15 + receiver)
+    print(f"    Тема: {match.subject}")
+    if match.sent_time:
+        print(f"    Отправлено: {format_datetime_gmt3(match.sent_time)}")
 
-def process_message(message, search_criteria, msg_num, output_dir=None):
-    """Обрабатывает отдельное сообщение"""
+
+def search_pst(pst_path, search_criteria, output_dir=None):
+    """Основная функция поиска в PST-файле"""
     try:
-        # Получаем заголовки сообщения
-        headers = message.get_transport_headers()
-        headers_lines = headers.splitlines() if headers else []
+        print(f"[+] Открываю PST-файл: {pst_path}")
+        search = iter_messages(pst_path, search_criteria,
+                               on_error=lambda error: print(f"[!] {error}"))
 
-        # Извлекаем данные из заголовков
-        sender_values = get_header_value(headers_lines, 'From')
-        receivers_values = get_header_value(headers_lines, 'To')
-        subject_values = get_header_value(headers_lines, 'Subject')
+        with search:
+            if output_dir:
+                ensure_output_dir(output_dir)
+                print(f"[+] Найденные письма будут сохранены в: {os.path.abspath(output_dir)}")
 
-        sender = sender_values[0] if sender_values else "Неизвестный отправитель"
-        receivers = receivers_values if receivers_values else ["Не указаны"]
-        subject = subject_values[0] if subject_values else "Без темы"
+            print(f"[+] Найдено корневых папок: {search.number_of_root_folders}")
 
-        body = get_message_body(message)
-        # Конвертируем время в GMT+3
-        received_time = convert_to_gmt3(getattr(message, 'delivery_time', None))
-        sent_time = convert_to_gmt3(getattr(message, 'client_submit_time', None))
+            for match in search:
+                print_match(match)
+                if output_dir:
+                    save_message_as_txt(match.message, output_dir, match.msg_num)
 
-        if not matches_criteria(sender, subject, body,
-                                received_time, sent_time, search_criteria):
-            return
-
-        print(f"\n[+] Найдено письмо #{msg_num}:")
-        print(f"    Отправитель: {sender}")
-        print(f"    Получатели: {receivers[0]}")
-        if len(receivers) > 1:
-            for receiver in receivers[1:]:
-                print(' ' * 15 + receiver)
-        print(f"    Тема: {subject}")
-        if sent_time:
-            print(f"    Отправлено: {format_datetime_gmt3(sent_time)}")
-
-        if output_dir:
-            save_message_as_txt(message, output_dir, msg_num)
+        print(f"\n[+] Поиск завершен. Обработано сообщений: {search.total}")
+        if output_dir and os.path.exists(output_dir):
+            txt_files = [f for f in os.listdir(output_dir) if f.endswith('.txt')]
+            print(f"[+] Сохранено писем: {len(txt_files)}")
+    except IOError as e:
+        print(f"[!] Ошибка при открытии файла: {e}")
     except Exception as e:
-        print(f"[!] Ошибка при обработке сообщения #{msg_num}: {e}")
+        print(f"[!] Критическая ошибка: {e}")
 
 
 def main():